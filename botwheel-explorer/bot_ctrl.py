@@ -1,25 +1,41 @@
 import argparse
 import asyncio
-import http.server
+import hashlib
+import io
+import ipaddress
 import json
-import math
+import logging
 import os
 import socket
-import socketserver
 import ssl
 import struct
-import threading
 import time
+from enum import IntEnum
 import can
-import qrcode
 from websockets.exceptions import ConnectionClosed
 from websockets.server import serve
 
+logger = logging.getLogger(__name__)
+
+# Use orjson for the websocket traffic if available. Telemetry is sent as text
+# frames, so the bytes returned by orjson are decoded.
+try:
+    import orjson
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
 
 # Connection Parameters
 
 WEBSOCKET_PORT = 8080
 HTTP_PORT = 8000
+HTTP_REQUEST_TIMEOUT = 5.0 # [s]
+
+QR_CACHE_FILE = os.path.expanduser('~/.botwheel_qr_cache')
 
 NODE_IDS = {
     'left': 0,
@@ -42,6 +58,7 @@ RIGHT_DIR = 1
 MAX_VEL = 1.0 # [m/s]
 MAX_YAW = 0.5 # [turns/s]
 
+MAIN_LOOP_INTERVAL = 0.1 # [s]
 BRAKE_TIMEOUT = 1.0
 STATE_TRANSITION_TIMEOUT = 0.5
 
@@ -58,11 +75,45 @@ AXIS_STATE_UNDEFINED = 0
 AXIS_STATE_IDLE = 1
 AXIS_STATE_CLOSED_LOOP_CONTROL = 8
 
+# Precompiled CAN payload formats
+_S_FF = struct.Struct('<ff')
+_S_II = struct.Struct('<II')
+_S_I = struct.Struct('<I')
+_S_HB = struct.Struct('<IBBB')
+
 class ODriveCAN():
     def __init__(self, bus, node_id):
         self.bus = bus
         self.node_id = node_id
 
+        # Precompute arbitration IDs
+        base = node_id << 5
+        self._id_heartbeat = base | 0x01 # 0x01: Heartbeat
+        self._id_state = base | 0x07 # 0x07: Set_Axis_State
+        self._id_encoder = base | 0x09 # 0x09: Get_Encoder_Estimates
+        self._id_vel = base | 0x0d # 0x0d: Set_Input_Vel
+        self._id_temp = base | 0x15 # 0x15: Get_Temperature
+        self._id_bus_vi = base | 0x17 # 0x17: Get_Bus_Voltage_Current
+        self._id_clear = base | 0x18 # 0x18: Clear_Errors
+        self._id_gains = base | 0x1b # 0x1b: Set_Vel_Gains
+        self._id_torques = base | 0x1c # 0x1c: Get_Torques
+
+        # arbitration_id: handler for all messages that this ODrive sends
+        self.rx_dispatch = {
+            self._id_heartbeat: self._on_heartbeat,
+            self._id_encoder: self._on_encoder_estimates,
+            self._id_temp: self._on_temperature,
+            self._id_bus_vi: self._on_bus_voltage_current,
+            self._id_torques: self._on_torques,
+        }
+
+        # Preconstructed TX messages. The payload buffers are updated in place
+        # before each send (the socketcan backend copies the frame on send).
+        self._gains_msg = can.Message(arbitration_id=self._id_gains, data=bytearray(8), is_extended_id=False)
+        self._clear_msg = can.Message(arbitration_id=self._id_clear, data=b'', is_extended_id=False)
+        self._state_msg = can.Message(arbitration_id=self._id_state, data=bytearray(4), is_extended_id=False)
+        self._vel_msg = can.Message(arbitration_id=self._id_vel, data=bytearray(8), is_extended_id=False)
+
         self.last_timestamp = 0.0
 
         # telemetry
@@ -78,87 +129,122 @@ class ODriveCAN():
 
     def set_gains(self, vel_gain, vel_integrator_gain):
         try:
-            self.bus.send(can.Message(
-                arbitration_id=(self.node_id << 5 | 0x01b), # 0x01b: Set_Vel_Gains
-                data=struct.pack('<ff', vel_gain, vel_integrator_gain),
-                is_extended_id=False
-            ))
+            _S_FF.pack_into(self._gains_msg.data, 0, vel_gain, vel_integrator_gain)
+            self.bus.send(self._gains_msg)
+            return True
         except (OSError, can.exceptions.CanOperationError):
-            pass # TX buffer might be full
+            return False # TX buffer might be full
     
-    def request_state(self, state):
+    def clear_errors(self):
+        try:
+            self.bus.send(self._clear_msg)
+            return True
+        except (OSError, can.exceptions.CanOperationError):
+            return False # TX buffer might be full
+
+    def set_axis_state(self, state):
         try:
-            self.bus.send(can.Message(
-                arbitration_id=(self.node_id << 5 | 0x18), # 0x18: Clear_Errors
-                data=b'',
-                is_extended_id=False
-            ))
-
-            self.bus.send(can.Message(
-                arbitration_id=(self.node_id << 5 | 0x07), # 0x07: Set_Axis_State
-                data=struct.pack('<I', state), # 8: AxisState.CLOSED_LOOP_CONTROL
-                is_extended_id=False
-            ))
+            _S_I.pack_into(self._state_msg.data, 0, state) # 8: AxisState.CLOSED_LOOP_CONTROL
+            self.bus.send(self._state_msg)
         except (OSError, can.exceptions.CanOperationError):
             pass # TX buffer might be full
 
     def send_vel(self, vel, torque_feedforward=0.0):
         try:
-            self.bus.send(can.Message(
-                arbitration_id=(self.node_id << 5 | 0x0d), # 0x0d: Set_Input_Vel
-                data=struct.pack('<ff', vel, torque_feedforward),
-                is_extended_id=False
-            ))
+            _S_FF.pack_into(self._vel_msg.data, 0, vel, torque_feedforward)
+            self.bus.send(self._vel_msg)
         except (OSError, can.exceptions.CanOperationError):
             pass # TX buffer might be full
 
-    def on_can_message(self, msg: can.Message):
-        if msg.arbitration_id == (self.node_id << 5 | 0x01): # 0x01: Heartbeat
-            self.error, self.state, result, traj_done = struct.unpack('<IBBB', bytes(msg.data[:7]))
-            self.last_timestamp = time.monotonic()
-        elif msg.arbitration_id == (self.node_id << 5 | 0x09): # 0x09: Get_Encoder_Estimates
-            pos, self.vel = struct.unpack('<ff', bytes(msg.data))
-        elif msg.arbitration_id == (self.node_id << 5 | 0x15): # 0x15: Get_Temperature
-            fet_temp, motor_temp = struct.unpack('<ff', bytes(msg.data))
-            self.fet_temp = None if math.isnan(fet_temp) else fet_temp
-            self.motor_temp = None if math.isnan(motor_temp) else motor_temp
-        elif msg.arbitration_id == (self.node_id << 5 | 0x17): # 0x17: Get_Bus_Voltage_Current
-            self.dc_voltage, self.dc_current = struct.unpack('<ff', bytes(msg.data))
-        elif msg.arbitration_id == (self.node_id << 5 | 0x1C): # 0x1C: Get_Torques
-            self.torque_setpoint, self.torque_estimate = struct.unpack('<ff', bytes(msg.data))
+    def _on_heartbeat(self, msg: can.Message):
+        self.error, self.state, result, traj_done = _S_HB.unpack_from(msg.data, 0)
+        self.last_timestamp = time.monotonic()
+
+    def _on_encoder_estimates(self, msg: can.Message):
+        pos, self.vel = _S_FF.unpack_from(msg.data, 0)
+
+    def _on_temperature(self, msg: can.Message):
+        # A float32 is NaN if all exponent bits are set and the mantissa is non-zero
+        fet_raw, motor_raw = _S_II.unpack_from(msg.data, 0)
+        fet_nan = (fet_raw & 0x7fffffff) > 0x7f800000
+        motor_nan = (motor_raw & 0x7fffffff) > 0x7f800000
+        if fet_nan and motor_nan:
+            self.fet_temp = self.motor_temp = None
+        else:
+            fet_temp, motor_temp = _S_FF.unpack_from(msg.data, 0)
+            self.fet_temp = None if fet_nan else fet_temp
+            self.motor_temp = None if motor_nan else motor_temp
+
+    def _on_bus_voltage_current(self, msg: can.Message):
+        self.dc_voltage, self.dc_current = _S_FF.unpack_from(msg.data, 0)
+
+    def _on_torques(self, msg: can.Message):
+        self.torque_setpoint, self.torque_estimate = _S_FF.unpack_from(msg.data, 0)
 
     def connected(self, now):
         return now - self.last_timestamp < ODRIVE_TIMEOUT
 
 
-def user_space_to_axis_space(vel, yaw):
-    vel_left = VEL_COEF * vel + YAW_COEF * yaw
-    vel_right = VEL_COEF * vel - YAW_COEF * yaw
-    return (vel_left * LEFT_DIR, vel_right * RIGHT_DIR)
-
-def axis_space_to_user_space(vel_left, vel_right):
-    vel_left *= LEFT_DIR
-    vel_right *= RIGHT_DIR
-    vel = (vel_left + vel_right) / 2 / VEL_COEF
-    yaw = (vel_left - vel_right) / 2 / YAW_COEF
-    return (vel, yaw)
+class State(IntEnum):
+    WAITING_FOR_ODRIVES = 0
+    COAST = 1
+    ENTERING_DRIVE = 2
+    DRIVE = 3
+    BRAKE = 4
+    ENTERING_COAST = 5
+
+# Wire representation of the states, e.g. State.ENTERING_DRIVE <-> 'entering-drive'
+_STATE_NAMES = {state: state.name.lower().replace('_', '-') for state in State}
+_STATES_BY_NAME = {name: state for state, name in _STATE_NAMES.items()}
+
+# State transitions based on user requests: (state, user_requested_state) -> new state
+_TRANSITIONS = {
+    **{(state, State.DRIVE): State.ENTERING_DRIVE for state in (State.WAITING_FOR_ODRIVES, State.COAST, State.BRAKE, State.ENTERING_COAST)},
+    **{(state, State.COAST): State.ENTERING_COAST for state in (State.WAITING_FOR_ODRIVES, State.ENTERING_DRIVE, State.DRIVE, State.BRAKE)},
+    (State.DRIVE, State.BRAKE): State.BRAKE,
+    (State.ENTERING_DRIVE, State.BRAKE): State.ENTERING_COAST,
+}
 
-def clamp(value, min_value, max_value):
-    return max(min(value, max_value), min_value)
+# State transitions based on timing, applied if no user request matched: state -> (new state, timeout)
+_TIMEOUT_TRANSITIONS = {
+    State.BRAKE: (State.ENTERING_COAST, BRAKE_TIMEOUT), # brake command times out after 1 second
+    State.ENTERING_DRIVE: (State.ENTERING_COAST, STATE_TRANSITION_TIMEOUT), # entering-drive state times out after 0.5 seconds
+}
 
 
 class ODriveCart():
     def __init__(self, bus, ignore_odrives):
         self.odrives = {k: ODriveCAN(bus, v) for k, v in NODE_IDS.items()}
-        can.Notifier(bus, [odrv.on_can_message for odrv in self.odrives.values()])
+
+        # Received messages are buffered and dispatched on the asyncio event loop
+        # (see can_rx_loop()) rather than on the Notifier thread.
+        self._rx_dispatch = {}
+        for odrv in self.odrives.values():
+            self._rx_dispatch.update(odrv.rx_dispatch)
+        self._reader = can.AsyncBufferedReader()
+        self._notifier = can.Notifier(bus, [self._reader], loop=asyncio.get_running_loop())
+
+        self._left = self.odrives['left']
+        self._right = self.odrives['right']
 
         self.ignore_odrives = ignore_odrives
-        self.enabled_odrives = [odrv for k, odrv in self.odrives.items() if not k in ignore_odrives]
+        self.enabled_odrives = tuple(odrv for k, odrv in self.odrives.items() if not k in ignore_odrives)
 
         self.user_commands = {} # key: connection identifier, value: dict {vel, yaw}
+        self._total_vel = 0.0 # sum of all user_commands vel values
+        self._total_yaw = 0.0 # sum of all user_commands yaw values
         self.user_requested_state = None
 
-        self.state = 'waiting-for-odrives'
+        self.state = State.WAITING_FOR_ODRIVES
+
+        # ODrives that still need a Clear_Errors for the current transition state.
+        # Errors are cleared once per transition, retried until the send succeeds.
+        self._needs_clear = set()
+
+        # ODrives that need to be sent the current gains. Gains are only sent
+        # when they change or when an ODrive (re)connects, and are retried
+        # until the send succeeds.
+        self._needs_gains = set(self.enabled_odrives)
 
         # Load gain settings from persistent config
         if os.path.isfile('config.json'):
@@ -167,23 +253,47 @@ class ODriveCart():
         else:
             self.config = {**DEFAULT_CONFIG}
 
+        # Serialized telemetry, rebuilt once per main loop tick and shared by all clients
+        self.telemetry_json = json_dumps(self._build_telemetry())
+        self.telemetry_updated = asyncio.Event()
+
     def set_config(self, config: dict):
         new_config = {**self.config, **config}
         if self.config != new_config:
             self.config = new_config
+            self._needs_gains.update(self.enabled_odrives)
             with open('config.json', 'w') as fp:
                 json.dump(self.config, fp)
 
-    @property
-    def telemetry(self):
-        vel, yaw = axis_space_to_user_space(
-            self.odrives['left'].vel or 0.0,
-            self.odrives['right'].vel or 0.0
-        )
+    def set_user_command(self, client, vel, yaw):
+        prev = self.user_commands.get(client)
+        if prev is not None:
+            self._total_vel -= prev['vel']
+            self._total_yaw -= prev['yaw']
+        self.user_commands[client] = {'vel': vel, 'yaw': yaw}
+        self._total_vel += vel
+        self._total_yaw += yaw
+
+    def remove_user_command(self, client):
+        prev = self.user_commands.pop(client, None)
+        if len(self.user_commands) == 0:
+            # Reset instead of subtracting to not accumulate rounding errors
+            self._total_vel = 0.0
+            self._total_yaw = 0.0
+        elif prev is not None:
+            self._total_vel -= prev['vel']
+            self._total_yaw -= prev['yaw']
+
+    def _build_telemetry(self):
+        # Convert from axis space to user space
+        vel_left = (self._left.vel or 0.0) * LEFT_DIR
+        vel_right = (self._right.vel or 0.0) * RIGHT_DIR
+        vel = (vel_left + vel_right) / 2 / VEL_COEF
+        yaw = (vel_left - vel_right) / 2 / YAW_COEF
         return {
             'vel': vel,
             'yaw': yaw,
-            'state': self.state,
+            'state': _STATE_NAMES[self.state],
             'odrives': {
                 k: {
                     'error': v.error,
@@ -200,30 +310,39 @@ class ODriveCart():
             'config': self.config
         }
 
+    async def can_rx_loop(self):
+        while True:
+            msg = await self._reader.get_message()
+            if msg.is_remote_frame:
+                continue # requests from other nodes, no payload to parse
+            handler = self._rx_dispatch.get(msg.arbitration_id)
+            if handler:
+                try:
+                    handler(msg)
+                except struct.error as e:
+                    # Don't let a malformed frame stop the control loop
+                    logger.warning("invalid CAN message 0x%03x: %s", msg.arbitration_id, e)
+
     async def main_loop(self):
+        next_tick = time.monotonic()
         while True:
             now = time.monotonic()
             
             # Implicitly request braking state when all clients are disconnected
             if len(self.user_commands) == 0:
-                self.user_requested_state = 'brake'
+                self.user_requested_state = State.BRAKE
 
             # State transitions based on user requests and timing
             state = self.state
 
-            if state != 'drive' and state != 'entering-drive' and self.user_requested_state == 'drive':
-                state = 'entering-drive'
-            elif state != 'coast' and state != 'entering-coast' and self.user_requested_state == 'coast':
-                state = 'entering-coast'
-            elif state == 'drive' and self.user_requested_state == 'brake':
-                state = 'brake'
-            elif state == 'entering-drive' and self.user_requested_state == 'brake':
-                state = 'entering-coast'
-            elif state == 'brake' and now - self.state_timestamp > BRAKE_TIMEOUT:
-                state = 'entering-coast' # brake command times out after 1 second
-            elif state == 'entering-drive' and now - self.state_timestamp > STATE_TRANSITION_TIMEOUT:
-                state = 'entering-coast' # entering-drive state times out after 1 second
-            
+            next_state = _TRANSITIONS.get((state, self.user_requested_state))
+            if next_state is None and state in _TIMEOUT_TRANSITIONS:
+                timeout_state, timeout = _TIMEOUT_TRANSITIONS[state]
+                if now - self.state_timestamp > timeout:
+                    next_state = timeout_state
+            if next_state is not None:
+                state = next_state
+
             self.user_requested_state = None
 
             # State transitions based on ODrive feedback
@@ -231,55 +350,80 @@ class ODriveCart():
             odrive_states = set(odrv.state for odrv in self.enabled_odrives)
             common_odrive_state = next(iter(odrive_states)) if len(odrive_states) == 1 else None
             if any(not odrv.connected(now) for odrv in self.enabled_odrives):
-                state = 'waiting-for-odrives'
-            elif state == 'waiting-for-odrives':
-                state = 'coast'
-            elif state == 'entering-drive' and common_odrive_state == AXIS_STATE_CLOSED_LOOP_CONTROL:
-                state = 'drive'
-            elif state == 'entering-coast' and common_odrive_state == AXIS_STATE_IDLE:
-                state = 'coast'
-            elif (state == 'drive' or state == 'brake') and common_odrive_state != AXIS_STATE_CLOSED_LOOP_CONTROL:
+                state = State.WAITING_FOR_ODRIVES
+            elif state == State.WAITING_FOR_ODRIVES:
+                state = State.COAST
+            elif state == State.ENTERING_DRIVE and common_odrive_state == AXIS_STATE_CLOSED_LOOP_CONTROL:
+                state = State.DRIVE
+            elif state == State.ENTERING_COAST and common_odrive_state == AXIS_STATE_IDLE:
+                state = State.COAST
+            elif (state == State.DRIVE or state == State.BRAKE) and common_odrive_state != AXIS_STATE_CLOSED_LOOP_CONTROL:
                 # In case of an error, one ODrive might disarm. In that case we immediately disarm the other one too
-                state = 'entering-coast'
+                state = State.ENTERING_COAST
 
             if self.state != state:
                 self.state = state
                 self.state_timestamp = now
-                print("state: " + state)
+                if state == State.ENTERING_COAST or state == State.ENTERING_DRIVE:
+                    self._needs_clear = set(self.enabled_odrives)
+                else:
+                    self._needs_clear = set()
+                logger.info("state: %s", _STATE_NAMES[state])
 
             # During the transition states, send periodic requests to each ODrive until confirmed
-            if state == 'entering-coast' or state == 'entering-drive':
-                target_state = AXIS_STATE_CLOSED_LOOP_CONTROL if state == 'entering-drive' else AXIS_STATE_IDLE
+            if state == State.ENTERING_COAST or state == State.ENTERING_DRIVE:
+                target_state = AXIS_STATE_CLOSED_LOOP_CONTROL if state == State.ENTERING_DRIVE else AXIS_STATE_IDLE
                 for odrv in self.enabled_odrives:
                     if odrv.connected(now) and odrv.state != target_state:
-                        odrv.request_state(target_state)
+                        if odrv in self._needs_clear and odrv.clear_errors():
+                            self._needs_clear.discard(odrv)
+                        odrv.set_axis_state(target_state)
 
             # Calculate velocity setpoints and send to ODrives
-            if state == 'drive':
-                total_vel = clamp(sum(cmd['vel'] for cmd in self.user_commands.values()), -MAX_VEL, MAX_VEL)
-                total_yaw = clamp(sum(cmd['yaw'] for cmd in self.user_commands.values()), -MAX_YAW, MAX_YAW)
+            if state == State.DRIVE:
+                total_vel = max(min(self._total_vel, MAX_VEL), -MAX_VEL)
+                total_yaw = max(min(self._total_yaw, MAX_YAW), -MAX_YAW)
             else:
                 total_vel = 0.0
                 total_yaw = 0.0
 
-            vel_left, vel_right = user_space_to_axis_space(total_vel, total_yaw)
+            # Convert from user space to axis space
+            vel_left = (VEL_COEF * total_vel + YAW_COEF * total_yaw) * LEFT_DIR
+            vel_right = (VEL_COEF * total_vel - YAW_COEF * total_yaw) * RIGHT_DIR
 
-            self.odrives['left'].send_vel(vel_left)
-            self.odrives['right'].send_vel(vel_right)
+            self._left.send_vel(vel_left)
+            self._right.send_vel(vel_right)
 
             for odrv in self.enabled_odrives:
-                odrv.set_gains(self.config['vel_gain'], self.config['vel_integrator_gain'])
-
-            # Wait for 100ms (10Hz)
-            await asyncio.sleep(0.1)
+                if not odrv.connected(now):
+                    self._needs_gains.add(odrv) # resend on reconnect
+                elif odrv in self._needs_gains:
+                    if odrv.set_gains(self.config['vel_gain'], self.config['vel_integrator_gain']):
+                        self._needs_gains.discard(odrv)
+
+            self.telemetry_json = json_dumps(self._build_telemetry())
+
+            # Wake up all clients that are waiting for new telemetry. set() resolves
+            # all pending waiters, so the event can be cleared again right away.
+            self.telemetry_updated.set()
+            self.telemetry_updated.clear()
+
+            # Wait until the next tick (10Hz). Sleeping until an absolute deadline
+            # keeps the loop period independent of the time spent in the loop body.
+            next_tick += MAIN_LOOP_INTERVAL
+            delay = next_tick - time.monotonic()
+            if delay < -MAIN_LOOP_INTERVAL:
+                # Resync instead of running several ticks back-to-back
+                logger.warning("main loop overrun by %.3fs", -delay)
+                next_tick = time.monotonic()
+            await asyncio.sleep(max(delay, 0.0))
 
 
 async def client_tx(websocket, cart: ODriveCart):
     try:
         while True:
-            #print(latest_telemetry)
-            await websocket.send(json.dumps(cart.telemetry))
-            await asyncio.sleep(0.1)
+            await websocket.send(cart.telemetry_json)
+            await cart.telemetry_updated.wait()
     except ConnectionClosed:
         pass
 
@@ -288,19 +432,19 @@ async def client_rx(websocket, cart):
         while True:
             # Receive message from client
             message = await websocket.recv()
-            data = json.loads(message)
+            data = json_loads(message)
             cart.set_config(data.get('config', {}))
             # Store the most recent vel/yaw command
             if 'vel' in data and 'yaw' in data:
-                cart.user_commands[websocket] = {'vel': data['vel'], 'yaw': data['yaw']}
+                cart.set_user_command(websocket, data['vel'], data['yaw'])
             new_state = data.get('state', None)
-            if new_state:
-                cart.user_requested_state = new_state
-                print("client requested " + new_state)
+            if new_state and isinstance(new_state, str):
+                cart.user_requested_state = _STATES_BY_NAME.get(new_state)
+                logger.debug("client requested %s", new_state)
     except ConnectionClosed:
-        print("client disconnected")
+        logger.info("client disconnected")
     finally:
-        cart.user_commands.pop(websocket, None)
+        cart.remove_user_command(websocket)
 
 # Method using socket.getattrinfo()
 def get_local_ips_1():
@@ -310,10 +454,34 @@ def get_local_ips_1():
             hostname = hostname + '.local' # without this suffix, sometimes only 127.0.0.1 is returned
         local_ip_addresses = set(ip[4][0] for ip in socket.getaddrinfo(hostname, None))
     except Exception as e:
-        print(f"Could not determine IP addresses: {e}")
+        logger.warning("Could not determine IP addresses: %s", e)
         return []
     return sorted(local_ip_addresses, key=lambda x: (':' in x, x)) # prioritize IPv4 addresses
 
+# Method using netlink (RTM_GETADDR), requires pyroute2. Unlike get_local_ips_1()
+# this does not involve any (potentially slow) hostname resolution.
+def get_local_ips_netlink():
+    from pyroute2 import IPRoute
+    with IPRoute() as ipr:
+        # IFA_ADDRESS is the peer address on point-to-point links, so prefer IFA_LOCAL
+        addresses = [msg.get_attr('IFA_LOCAL') or msg.get_attr('IFA_ADDRESS') for msg in ipr.get_addr()]
+    # Loopback and link-local addresses (127.0.0.0/8, ::1, 169.254.0.0/16, fe80::/10)
+    # are not usable in the connection URL
+    local_ip_addresses = set(
+        addr for addr in addresses
+        if addr and not (ipaddress.ip_address(addr).is_loopback or ipaddress.ip_address(addr).is_link_local)
+    )
+    return sorted(local_ip_addresses, key=lambda x: (':' in x, x)) # prioritize IPv4 addresses
+
+def get_local_ips():
+    try:
+        return get_local_ips_netlink()
+    except ImportError:
+        pass # pyroute2 not installed
+    except Exception as e:
+        logger.warning("Could not query IP addresses via netlink: %s", e)
+    return get_local_ips_1()
+
 # # Method using fib_tree
 # def get_local_ips_2():
 #     local_ips = {} # key: string, value: priority (lowest first)
@@ -347,6 +515,46 @@ def get_local_ips_1():
 #     return sorted(local_ip_addresses, reverse=True) # prioritize higher value addresses
 
 
+def render_qr_code(url):
+    """
+    Returns the QR code for the specified URL as ASCII art.
+    The result is cached in QR_CACHE_FILE so that the qrcode library only needs
+    to be loaded when the URL changes.
+    """
+    key = hashlib.blake2b(url.encode()).hexdigest()[:16]
+    try:
+        with open(QR_CACHE_FILE, 'r', encoding='utf-8') as fp:
+            if fp.readline().rstrip('\n') == key:
+                qr_ascii = fp.read()
+                if qr_ascii:
+                    return qr_ascii
+    except (OSError, ValueError):
+        pass # no valid cache
+
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    out = io.StringIO()
+    qr.print_ascii(out=out)
+    qr_ascii = out.getvalue()
+
+    try:
+        # Write to a temporary file first so that an interrupted write can't
+        # leave behind a truncated QR code
+        with open(QR_CACHE_FILE + '.tmp', 'w', encoding='utf-8') as fp:
+            fp.write(key + '\n' + qr_ascii)
+        os.replace(QR_CACHE_FILE + '.tmp', QR_CACHE_FILE)
+    except OSError:
+        pass # caching is optional
+    return qr_ascii
+
 def print_connection_hints(local_ip_addresses, ssl: bool):
     if len(local_ip_addresses) == 0:
         print("No IP address found")
@@ -358,15 +566,7 @@ def print_connection_hints(local_ip_addresses, ssl: bool):
 
         url = f"{'https' if ssl else 'http'}://{local_ip_addresses[0]}:{HTTP_PORT}/bot_ctrl.html#autoconnect"
 
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        qr.print_ascii()
+        print(render_qr_code(url), end='')
 
         print(url)
         print()
@@ -378,20 +578,28 @@ def print_connection_hints(local_ip_addresses, ssl: bool):
         print("##################################################################")
         print()
 
-class MyRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/bot_ctrl.html':
-            super().do_GET()
-        else:
-            self.send_response(404)
-            self.send_header('Content-Type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b'File not found')
+async def read_http_request_line(reader: asyncio.StreamReader):
+    request_line = await reader.readline()
+    while (await reader.readline()).strip(): pass # skip headers
+    return request_line
 
-def run_http_server(httpd: socketserver.TCPServer):
-    print(f"Serving on port {HTTP_PORT}")
-    httpd.allow_reuse_address = True
-    httpd.serve_forever()
+async def handle_http_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, html: bytes):
+    try:
+        request_line = await asyncio.wait_for(read_http_request_line(reader), HTTP_REQUEST_TIMEOUT)
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/bot_ctrl.html':
+            status, body = b'200 OK', html
+        else:
+            status, body = b'404 Not Found', b'File not found'
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                     b'Content-Type: text/html\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'Connection: close\r\n\r\n' + body)
+        await writer.drain()
+    except (ConnectionError, ssl.SSLError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        pass # client disconnected, timed out or sent an oversized line
+    finally:
+        writer.close()
 
 
 async def main():
@@ -403,11 +611,14 @@ async def main():
                         help=f'Disable the specified ODrives. Allowed values: {NODE_IDS.keys()}. '
                         "Useful for testing when one or more ODrives are disconnected. If ignored ODrives are present, "
                         "their telemetry will still be relayed but they will be set to IDLE.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable debug logging.")
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
 
-    local_ip_addresses = get_local_ips_1()
+    local_ip_addresses = get_local_ips()
     bus = can.interface.Bus(args.can, bustype="socketcan")
 
     # Flush CAN RX buffer so there are no more old pending messages
@@ -421,29 +632,33 @@ async def main():
     else:
         ssl_context = None
 
-    # Launch HTTP server
-    with socketserver.TCPServer(("", HTTP_PORT), MyRequestHandler) as httpd:
-        if not ssl_context is None:
-            httpd.socket = ssl_context.wrap_socket(httpd.socket)
-        threading.Thread(target=run_http_server, args=(httpd,)).start()
-
-        try:
-            # Launch websocket server
-            async def handle_client(websocket, path):
-                print("client connected")
-                await asyncio.gather(
-                    asyncio.create_task(client_tx(websocket, cart)),
-                    asyncio.create_task(client_rx(websocket, cart))
-                )
+    # Launch HTTP server. The page is loaded once and served from memory.
+    with open('bot_ctrl.html', 'rb') as fp:
+        html = fp.read()
+    http_server = await asyncio.start_server(lambda reader, writer: handle_http_request(reader, writer, html),
+                                             '', HTTP_PORT, ssl=ssl_context, reuse_address=True)
+    print(f"Serving on port {HTTP_PORT}")
 
-            async with serve(handle_client, '0.0.0.0', WEBSOCKET_PORT, ssl=ssl_context, ping_timeout=2.5, ping_interval=1):
-                print_connection_hints(local_ip_addresses, args.ssl)
+    async with http_server:
+        # Launch websocket server
+        async def handle_client(websocket, path):
+            logger.info("client connected")
+            await asyncio.gather(
+                asyncio.create_task(client_tx(websocket, cart)),
+                asyncio.create_task(client_rx(websocket, cart))
+            )
 
-                # Launch main loop
-                await cart.main_loop()
+        async with serve(handle_client, '0.0.0.0', WEBSOCKET_PORT, ssl=ssl_context, ping_timeout=2.5, ping_interval=1):
+            print_connection_hints(local_ip_addresses, args.ssl)
 
-        finally:
-            httpd.shutdown()
+            # Launch CAN receive loop and main loop
+            await asyncio.gather(cart.can_rx_loop(), cart.main_loop())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Use the faster libuv based event loop if available
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -41,13 +41,15 @@ def get_address_msg(bus: can.Bus):
     )
     bus.send(msg)
 
-def set_address_msg(bus, sn, node_id):
-    msg = can.Message(
+def make_address_msg(sn, node_id):
+    return can.Message(
         arbitration_id=(BROADCAST_NODE_ID << 5) | ADDRESS_CMD,
         data=bytes([node_id]) + sn.to_bytes(6, byteorder='little'),
         is_extended_id=False
     )
-    bus.send(msg)
+
+def set_address_msg(bus, sn, node_id):
+    bus.send(make_address_msg(sn, node_id))
 
 def identify_msg(bus: can.Bus, node_id: int, enable: bool):
     msg = can.Message(
@@ -70,6 +72,7 @@ class Discoverer():
         self.bus = bus
         self.last_received_time = time.monotonic()
         self.discovered_devices = {}  # serial_number: node_id
+        self.used_node_ids = 0 # bitmask of node IDs that are known to be in use
         self.auto_assign = False
 
     def __enter__(self):
@@ -81,14 +84,17 @@ class Discoverer():
         pass
 
     def assign_free_node_id(self, serial_number):
-        next_free_node_id = next(i for i in range(len(self.discovered_devices) + 1) if i not in self.discovered_devices.values())
-        if next_free_node_id > MAX_NODE_ID:
+        free_node_ids = ~self.used_node_ids & ((1 << (MAX_NODE_ID + 1)) - 1)
+        if free_node_ids == 0:
             print(f"Can't address {sn_str(serial_number)} because there are too many devices on the bus.")
+            return
+        next_free_node_id = (free_node_ids & -free_node_ids).bit_length() - 1 # lowest free node ID
 
         print(f"Assigning node ID {next_free_node_id} to {sn_str(serial_number)}")
 
         set_address_msg(self.bus, serial_number, next_free_node_id)
         self.discovered_devices[serial_number] = next_free_node_id
+        self.used_node_ids |= 1 << next_free_node_id
 
     def on_message_received(self, msg):
         cmd_id = msg.arbitration_id & 0x1F
@@ -105,6 +111,8 @@ class Discoverer():
             #    print(f"Rediscovered ODrive {sn_str(serial_number)} ({node_id_str})")
             
             self.discovered_devices[serial_number] = node_id if node_id != BROADCAST_NODE_ID else None
+            if node_id != BROADCAST_NODE_ID:
+                self.used_node_ids |= 1 << node_id
 
             if self.discovered_devices[serial_number] is None:
                 self.last_received_time = time.monotonic()
@@ -192,7 +200,7 @@ def identify_ui(bus: can.Bus, node_ids: List[int], user_labels: List[str]) -> Di
                     try:
                         num = int(user_response)
                     except ValueError:
-                        pass # not a number
+                        num = -1 # not a number
                     if num >= 0 and num < len(user_labels):
                         break
 
@@ -231,8 +239,11 @@ async def set_addresses(bus: can.Bus, sn_to_node_id: Dict[int, int]):
     ----------
     sn_to_node_id: dict of the form {serial_number: node_id}
     """
-    for sn, node_id in sn_to_node_id:
-        set_address_msg(bus, sn, node_id)
+    # Build all messages up front and send them in one burst
+    msgs = [make_address_msg(sn, node_id) for sn, node_id in sn_to_node_id.items()]
+    for msg in msgs:
+        bus.send(msg)
+    await asyncio.sleep(0)
 
 
 async def main():
@@ -299,7 +310,7 @@ async def main():
 
         if len(sn_to_new_addr):
             print(f"Assigning new node IDs to {len(sn_to_new_addr)} ODrives")
-            await set_addresses(bus, sn_to_new_addr)
+            await set_addresses(bus, dict(sn_to_new_addr))
 
         if len(sn_to_target_addr) and args.save_config:
             print(f"Saving configuration on {len(sn_to_target_addr)} ODrives")
@@ -311,5 +322,11 @@ async def main():
     sys.exit(0 if ok else 1)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    # Use the faster libuv based event loop if available
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
 
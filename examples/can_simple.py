@@ -15,6 +15,12 @@ import struct
 
 node_id = 0 # must match `<odrv>.axis0.config.can.node_id`. The default is 0.
 
+# Arbitration IDs of the messages used below
+ARB_HEARTBEAT = node_id << 5 | 0x01 # 0x01: Heartbeat
+ARB_SET_AXIS_STATE = node_id << 5 | 0x07 # 0x07: Set_Axis_State
+ARB_ENCODER_ESTIMATES = node_id << 5 | 0x09 # 0x09: Get_Encoder_Estimates
+ARB_SET_INPUT_VEL = node_id << 5 | 0x0d # 0x0d: Set_Input_Vel
+
 bus = can.interface.Bus("can0", bustype="socketcan")
 
 # Flush CAN RX buffer so there are no more old pending messages
@@ -22,27 +28,27 @@ while not (bus.recv(timeout=0) is None): pass
 
 # Put axis into closed loop control state
 bus.send(can.Message(
-    arbitration_id=(node_id << 5 | 0x07), # 0x07: Set_Axis_State
+    arbitration_id=ARB_SET_AXIS_STATE,
     data=struct.pack('<I', 8), # 8: AxisState.CLOSED_LOOP_CONTROL
     is_extended_id=False
 ))
 
 # Wait for axis to enter closed loop control by scanning heartbeat messages
 for msg in bus:
-    if msg.arbitration_id == (node_id << 5 | 0x01): # 0x01: Heartbeat
-        error, state, result, traj_done = struct.unpack('<IBBB', bytes(msg.data[:7]))
+    if msg.arbitration_id == ARB_HEARTBEAT:
+        error, state, result, traj_done = struct.unpack_from('<IBBB', msg.data, 0)
         if state == 8: # 8: AxisState.CLOSED_LOOP_CONTROL
             break
 
 # Set velocity to 1.0 turns/s
 bus.send(can.Message(
-    arbitration_id=(node_id << 5 | 0x0d), # 0x0d: Set_Input_Vel
+    arbitration_id=ARB_SET_INPUT_VEL,
     data=struct.pack('<ff', 1.0, 0.0), # 1.0: velocity, 0.0: torque feedforward
     is_extended_id=False
 ))
 
 # Print encoder feedback
 for msg in bus:
-    if msg.arbitration_id == (node_id << 5 | 0x09): # 0x09: Get_Encoder_Estimates
-        pos, vel = struct.unpack('<ff', bytes(msg.data))
+    if msg.arbitration_id == ARB_ENCODER_ESTIMATES:
+        pos, vel = struct.unpack_from('<ff', msg.data, 0)
         print(f"pos: {pos:.3f} [turns], vel: {vel:.3f} [turns/s]")